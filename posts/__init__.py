@@ -1,13 +1,39 @@
 import os
 
+import orjson
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider which parses and serializes with orjson.  sort_keys and
+    indentation (used when compact is off) map to orjson options; other
+    json.dumps arguments such as ensure_ascii and separators are ignored.
+    """
+
+    def dumps(self, obj, **kwargs):
+        option = 0
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        default = kwargs.get("default", self.default)
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-config_path = os.environ.get("CONFIG_PATH", "posts.config.DevelopmentConfig")
+app.json = OrjsonProvider(app)
+config_path = os.environ.get("CONFIG_PATH", "posts.config.ProductionConfig")
 app.config.from_object(config_path)
 
 from . import api
 
-from .database import Base, engine
+from .database import Base, engine, session
 Base.metadata.create_all(engine)
 
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """Close the request's session, returning its connection to the pool"""
+    session.remove()
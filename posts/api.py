@@ -1,12 +1,17 @@
-import json
-
+import fastjsonschema
+import orjson
+from fastjsonschema import JsonSchemaValueException
 from flask import request, Response, url_for
-from jsonschema import validate, ValidationError
+from sqlalchemy import LargeBinary, String
+from sqlalchemy import cast, delete, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
 
 from . import models
 from . import decorators
+from .cache import PostCache
 from posts import app
 from .database import session
+from .responses import json_response
 
 post_schema = {
     "properties":{
@@ -16,98 +21,163 @@ post_schema = {
     "required": ["title", "body"]
 }
 
+# Matches the post_get route, so Location headers can be built without
+# walking the URL map with url_for
+POST_LOCATION = "/api/posts/{}"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Compile the schema once into a validator function
+validate_post = fastjsonschema.compile(post_schema)
+
+# Serialized posts keyed by id, dropped whenever the post is changed.
+# The cache is per process; deployments running several workers should
+# move it to a shared store such as Redis using the same keys.
+post_cache = PostCache(maxsize=10000)
+
+def text_filter(column, value):
+    """
+    Filter for rows whose column contains the words in value, using the
+    full-text indexes.  Words match after stemming, so partial words don't
+    match and stop words such as "the" match nothing.
+    """
+    query = func.plainto_tsquery(literal_column("'english'"), value)
+    return models.search_vector(column).op("@@")(query)
+
 @app.route("/api/posts", methods=["GET"])
 @decorators.accept("application/json")
 def posts_get():
-    """Get a list of posts"""
+    """Get a page of posts, starting after the post with id `after`"""
     
     title_like = request.args.get("title_like")
     body_like = request.args.get("body_like")
-
-    posts = session.query(models.Post)
-    if title_like:
-        posts = posts.filter(models.Post.title.contains(title_like))
-    if body_like:
-        posts = posts.filter(models.Post.body.contains(body_like))
-    posts = posts.order_by(models.Post.id)
-
-    #Convert posts to JSON
-    data = json.dumps([post.as_dictionary() for post in posts])
-    return Response(data, 200, mimetype="application/json")
+    after = request.args.get("after", 0, type=int)
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Select the stored JSON directly so no Post instances get built and
+    # nothing needs encoding
+    posts = session.query(models.Post.id, models.Post.body_json)
+    for column, value in ((models.Post.title, title_like),
+                          (models.Post.body, body_like)):
+        if value:
+            posts = posts.filter(text_filter(column, value))
+    # Page by id rather than OFFSET so each page is an index range scan
+    posts = posts.filter(models.Post.id > after)
+    posts = posts.order_by(models.Post.id).limit(limit).all()
+
+    # A full page may have more posts after it, so point the client at
+    # the next one
+    headers = None
+    if len(posts) == limit:
+        next_url = url_for("posts_get", title_like=title_like,
+                           body_like=body_like, after=posts[-1].id,
+                           limit=limit)
+        headers = {"Link": '<{}>; rel="next"'.format(next_url)}
+
+    data = b"[" + b",".join(body_json for id_, body_json in posts) + b"]"
+    return Response(data, 200, headers=headers, mimetype="application/json")
 
 @app.route("/api/posts", methods=["POST"])
 @decorators.require("application/json")
 def posts_post():
     """Accepts and adds a post to the database"""
-    data = request.json
+    data = request.get_json(cache=True)
 
     try:
-        validate(data, post_schema)
-    except ValidationError as error:
+        validate_post(data)
+    except JsonSchemaValueException as error:
         data = {"message": error.message}
-        return Response(json.dumps(data), 422, mimetype="application/json")
-
-    post = models.Post(title=data["title"], body=data["body"])
-    session.add(post)
+        return json_response(data, 422)
+
+    # Insert the post and its serialized JSON in a single statement.  The
+    # id only exists once the statement runs, so the JSON is put together
+    # in SQL from the id and the rest of the post, which is encoded here
+    # exactly as orjson would encode the whole post.
+    fields = orjson.dumps({"title": data["title"], "body": data["body"]})[1:]
+    sequence = func.pg_get_serial_sequence(models.Post.__tablename__, "id")
+    new_id = select(func.nextval(sequence).label("id")).subquery()
+    prefix = literal('{"id":') + cast(new_id.c.id, String) + literal(",")
+    body_json = func.convert_to(prefix, literal_column("'UTF8'")).op(
+        "||", return_type=LargeBinary)(literal(fields, LargeBinary))
+    statement = insert(models.Post).from_select(
+        ["id", "title", "body", "body_json"],
+        select(new_id.c.id, literal(data["title"]), literal(data["body"]),
+               body_json)
+    ).returning(models.Post.id)
+    id = session.execute(statement).scalar()
     session.commit()
 
     # Return a 201 Created, containing the post as JSON and with the
     # Location header set to the location of the past
-    data = json.dumps(post.as_dictionary())
-    headers = {"Location": url_for("post_get", id=post.id)}
+    data = '{{"id":{},'.format(id).encode("utf-8") + fields
+    headers = {"Location": POST_LOCATION.format(id)}
     return Response(data, 201, headers=headers, mimetype="application/json")
 
 @decorators.accept("application/json")
 @app.route("/api/posts/<int:id>", methods=["GET"])
 def post_get(id):
     """Get a single post"""
-    post = session.query(models.Post).get(id)
+    data, generation = post_cache.lookup(id)
+    if data is None:
+        post = session.get(models.Post, id)
 
-    if not post:
-        message = "Could not find post with id {}".format(id)
-        data = json.dumps({"message": message})
-        return Response(data, 404, mimetype="application/json")
+        if not post:
+            message = "Could not find post with id {}".format(id)
+            return json_response({"message": message}, 404)
+
+        data = post.body_json
+        post_cache.set(id, data, generation)
 
-    data = json.dumps(post.as_dictionary())
     return Response(data, 200, mimetype="application/json")
 
 @app.route("/api/posts/<int:id>", methods=["DELETE"])
 def post_delete(id):
     """Delete a single post"""
-    post = session.query(models.Post).get(id)
-    session.delete(post)
+    statement = delete(models.Post).where(models.Post.id == id)
+    deleted = session.execute(statement).rowcount
     session.commit()
 
-    message = "{} has been deleted successfully".format(id)
-    data = json.dumps({"message": message})
+    if not deleted:
+        message = "Could not find post with id {}".format(id)
+        return json_response({"message": message}, 404)
 
-    return Response(data, 200, mimetype="application/json")
+    post_cache.invalidate(id)
+    message = "{} has been deleted successfully".format(id)
+    return json_response({"message": message})
 
 @app.route("/api/posts/<int:id>", methods=["PUT"])
 def post_put(id):
-    data = request.json
+    """Adds or replaces the post with the given id"""
+    data = request.get_json(cache=True)
 
     try:
-        validate(data, post_schema)
-        post = session.query(models.Post).get(id)
-        if not post:
-            new_post = models.Post(title=data["title"], body=data["body"], id=id)
-            session.add(new_post)
-            session.commit()
-            
-            message = "New post has been added with Title: {}".format(data["title"])
-            data = json.dumps({"message": message})
-
-            return Response(data, 201, mimetype="application/json")
-        else:
-            post.title = data["title"]
-            post.body = data["body"]
-            session.commit()
-            message = "Post has been updated"
-            data = json.dumps({"message": message})
-            return Response(data, 200, mimetype="application/json")
-
-
-    except ValidationError as error:
+        validate_post(data)
+    except JsonSchemaValueException as error:
         data = {"message": error.message}
-        return Response(json.dumps(data), 422, mimetype="application/json")
\ No newline at end of file
+        return json_response(data, 422)
+
+    # Insert or update in a single statement.  Being Core SQL, it skips the
+    # mapper events, so the serialized post is written here too.  A row
+    # which was just inserted has no xmax, telling the two cases apart.
+    body_json = orjson.dumps({"id": id, "title": data["title"],
+                              "body": data["body"]})
+    values = {"id": id, "title": data["title"], "body": data["body"],
+              "body_json": body_json}
+    statement = insert(models.Post).values(values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.Post.id],
+        set_={name: statement.excluded[name]
+              for name in ("title", "body", "body_json")}
+    ).returning(literal_column("xmax = 0"))
+    inserted = session.execute(statement).scalar()
+    session.commit()
+    post_cache.invalidate(id)
+
+    # Respond with the post as stored, which is already serialized
+    if inserted:
+        headers = {"Location": POST_LOCATION.format(id)}
+        return Response(body_json, 201, headers=headers,
+                        mimetype="application/json")
+    return Response(body_json, 200, mimetype="application/json")
@@ -0,0 +1,39 @@
+import threading
+
+from cachetools import LRUCache
+
+class PostCache(object):
+    """
+    LRU cache of serialized posts keyed by id.  cachetools caches are not
+    thread-safe, and even reads reorder an LRUCache, so every access is
+    made under a lock.
+
+    A post read from the database may be changed by another request before
+    it is stored, so lookups also return a generation which is bumped by
+    every invalidation, and a post is only stored if none has happened
+    since it was looked up.
+    """
+
+    def __init__(self, maxsize):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def lookup(self, id):
+        """Return the cached post, or None, and the current generation"""
+        with self._lock:
+            return self._cache.get(id), self._generation
+
+    def set(self, id, data, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._cache[id] = data
+
+    def invalidate(self, id):
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -2,6 +2,12 @@ class DevelopmentConfig(object):
     DATABASE_URI = "postgresql:///posts"
     DEBUG = True
 
+class ProductionConfig(object):
+    DATABASE_URI = "postgresql:///posts"
+    DEBUG = False
+    TESTING = False
+    PROPAGATE_EXCEPTIONS = True
+
 class TestingConfig(object):
     DATABASE_URI = "postgresql:///posts-test"
     DEBUG = True
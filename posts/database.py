@@ -1,10 +1,18 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from posts import app
 
-engine = create_engine(app.config["DATABASE_URI"])
+# Compiled SQL is cached per statement shape, so every request reuses the
+# compiled form of the handful of queries the API builds.  The pool is sized
+# for concurrent requests; keep workers * (pool_size + max_overflow) within
+# the server's max_connections.
+engine = create_engine(app.config["DATABASE_URI"], query_cache_size=1200,
+                       pool_size=20, max_overflow=40, pool_pre_ping=True,
+                       pool_recycle=1800, future=True)
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
-session = Session()
+# Each thread, and so each request, gets its own session; posts are not
+# expired on commit so responses can be built from them without a reload
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+session = scoped_session(Session)
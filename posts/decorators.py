@@ -1,7 +1,8 @@
-import json
 from functools import wraps
 
-from flask import request, Response
+from flask import request
+
+from .responses import json_response
 
 def accept(mimetype):
     def decorator(func):
@@ -16,8 +17,7 @@ def accept(mimetype):
                 # TODO: Where does accept_mimetypes come from?
                 return func(*args, **kwargs)
             message = "Request must accept {} data".format(mimetype)
-            data = json.dumps({"message": message})
-            return Response(data, 406, mimetype="application/json")
+            return json_response({"message": message}, 406)
         return wrapper
     return decorator
 
@@ -32,7 +32,6 @@ def require(mimetype):
             if(request.mimetype == mimetype):
                 return func(*args, **kwargs)
             message = "Request must contain {} data".format(mimetype)
-            data = json.dumps({"message": message})
-            return Response(data, 415, mimetype="application/json")
+            return json_response({"message": message}, 415)
         return wrapper
     return decorator
\ No newline at end of file
@@ -1,13 +1,31 @@
-from sqlalchemy import Column, Integer, String, Sequence
+from sqlalchemy import Column, Index, Integer, LargeBinary, String, Sequence
+from sqlalchemy import func, literal_column
 
 from .database import Base
 
+def search_vector(column):
+    """
+    The tsvector a column is searched by, shared by the full-text indexes
+    and the queries so Postgres can match one to the other
+    """
+    return func.to_tsvector(literal_column("'english'"), column)
+
 class Post(Base):
     __tablename__ = "posts"
 
     id = Column(Integer, primary_key=True)
     title = Column(String(128))
     body = Column(String(1024))
+    # The post serialized as JSON, so reads can send it without encoding
+    body_json = Column(LargeBinary, nullable=False)
+
+    # Full-text indexes backing the title_like and body_like searches
+    __table_args__ = (
+        Index("posts_title_fts", search_vector(title),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("posts_body_fts", search_vector(body),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
 
     def as_dictionary(self):
         post = {
@@ -15,4 +33,4 @@ class Post(Base):
             "title" : self.title,
             "body" : self.body
         }
-        return post
\ No newline at end of file
+        return post
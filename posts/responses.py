@@ -0,0 +1,7 @@
+import orjson
+from flask import Response
+
+def json_response(data, status=200, headers=None):
+    """Serialize data with orjson, which hands Response bytes directly"""
+    return Response(orjson.dumps(data), status, headers=headers,
+                    mimetype="application/json")
@@ -0,0 +1,57 @@
+"""
+Upgrades an existing database to the current schema.  This is a one-off
+deploy step rather than something done on import, since it may alter the
+posts table, backfill it and build indexes, locking out writes meanwhile:
+
+    python -m posts.schema
+"""
+import orjson
+from sqlalchemy import bindparam, inspect, select, text
+
+from .database import engine
+from .models import Post
+
+def upgrade(engine):
+    """
+    Bring an existing posts table up to date with the model, which
+    create_all won't do for tables that already exist.  Safe to run
+    again; it does nothing once the database is up to date.
+    """
+    table = Post.__table__
+    with engine.begin() as connection:
+        columns = {column["name"]: column
+                   for column in inspect(connection).get_columns(table.name)}
+        body_json = columns.get("body_json")
+        if body_json is None or body_json["nullable"]:
+            connection.execute(text(
+                "ALTER TABLE posts ADD COLUMN IF NOT EXISTS body_json BYTEA"))
+            backfill_body_json(connection)
+            connection.execute(text(
+                "ALTER TABLE posts ALTER COLUMN body_json SET NOT NULL"))
+
+        # The full-text indexes, built from the model so they match the
+        # expressions the searches use
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def backfill_body_json(connection, batch_size=1000):
+    """Serialize the posts which were stored without their JSON"""
+    table = Post.__table__
+    missing = (select(table.c.id, table.c.title, table.c.body)
+               .where(table.c.body_json.is_(None))
+               .limit(batch_size))
+    update = (table.update()
+              .where(table.c.id == bindparam("post_id"))
+              .values(body_json=bindparam("serialized")))
+    while True:
+        rows = connection.execute(missing).all()
+        if not rows:
+            break
+        connection.execute(update, [
+            {"post_id": id_, "serialized": orjson.dumps(
+                {"id": id_, "title": title, "body": body})}
+            for id_, title, body in rows
+        ])
+
+if __name__ == "__main__":
+    upgrade(engine)
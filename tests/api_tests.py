@@ -1,40 +1,84 @@
 import unittest
 import os
 import json
+import contextlib
 try: from urllib.parse import urlparse
 except ImportError: from urlparse import urlparse # Python 2 compatibility
+try: from unittest import mock
+except ImportError: import mock # Python 2 compatibility
+
+from flask import Request
+from sqlalchemy import event, inspect, text
 
 # Configure our app to use the testing databse
 os.environ["CONFIG_PATH"] = "posts.config.TestingConfig"
 
 from posts import app
 from posts import models
+from posts.api import post_cache
+from posts.schema import upgrade
 from posts.database import Base, engine, session
 
+@contextlib.contextmanager
+def count_queries(connectable):
+    """Collect the SQL statements executed on connectable"""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        queries.append(statement)
+
+    event.listen(connectable, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(connectable, "before_cursor_execute",
+                     before_cursor_execute)
+
 class TestAPI(unittest.TestCase):
     """ Tests for the posts API """
 
+    @classmethod
+    def setUpClass(cls):
+        # Set up the tables in the database once for the whole class
+        Base.metadata.create_all(engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Remove the tables from the database
+        Base.metadata.drop_all(engine)
+
     def setUp(self):
         """ Test setup """
         self.client = app.test_client()
 
-        # Set up the tables in the database
-        Base.metadata.create_all(engine)
-
     def tearDown(self):
         """ Test teardown """
-        session.close()
-        # Remove the tables and their data from the database
-        Base.metadata.drop_all(engine)
-    
+        session.remove()
+        post_cache.clear()
+        # Empty the tables and reset their ids, which is much cheaper than
+        # dropping and recreating them for every test
+        tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        with engine.begin() as connection:
+            connection.execute(text(
+                "TRUNCATE {} RESTART IDENTITY CASCADE".format(tables)))
+
     def create_posts(self):
         """Getting posts from a populated database"""
-        postA = models.Post(title = "Example Post A", body = "Just the body")
-        postB = models.Post(title = "Example Post B", body = "Just another body")
-        postC = models.Post(title = "Example whistles C", body = "Post with whiskers")
-        session.add_all([postA, postB, postC])
-        session.commit()
-        return postA.id, postB.id, postC.id
+        # Posts are created through the API, which is what stores their JSON
+        posts = [
+            {"title": "Example Post A", "body": "Just the body"},
+            {"title": "Example Post B", "body": "Just another body"},
+            {"title": "Example whistles C", "body": "Post with whiskers"}
+        ]
+        ids = []
+        for post in posts:
+            response = self.client.post("/api/posts",
+                data=json.dumps(post),
+                content_type="application/json",
+                headers=[("Accept", "application/json")])
+            ids.append(json.loads(response.data.decode("ascii"))["id"])
+        return tuple(ids)
 
     def test_get_empty_posts(self):
         response = self.client.get("/api/posts", 
@@ -49,8 +93,10 @@ class TestAPI(unittest.TestCase):
     def test_created_posts(self):
         self.create_posts()
 
-        response = self.client.get("/api/posts", 
-            headers=[("Accept", "application/json")])
+        with count_queries(engine) as queries:
+            response = self.client.get("/api/posts", 
+                headers=[("Accept", "application/json")])
+        self.assertEqual(len(queries), 1)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.mimetype, "application/json")
 
@@ -65,6 +111,25 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(postB["title"], "Example Post B")
         self.assertEqual(postB["body"], "Just another body")
 
+    def test_get_posts_paginated(self):
+        post_a_id, post_b_id, post_c_id = self.create_posts()
+
+        response = self.client.get("/api/posts?limit=2",
+            headers=[("Accept", "application/json")])
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data.decode("ascii"))
+        self.assertEqual([post["id"] for post in data], [post_a_id, post_b_id])
+
+        next_url = response.headers.get("Link").split(";")[0].strip("<>")
+        response = self.client.get(next_url,
+            headers=[("Accept", "application/json")])
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get("Link"))
+
+        data = json.loads(response.data.decode("ascii"))
+        self.assertEqual([post["id"] for post in data], [post_c_id])
+
     def test_get_post(self):
         post_a_id, post_b_id, post_c_id = self.create_posts()
 
@@ -78,6 +143,64 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(post["title"], "Example Post B")
         self.assertEqual(post["body"], "Just another body")
 
+    def test_get_post_after_update(self):
+        """Updating a post replaces the cached copy"""
+        post_a_id, post_b_id, post_c_id = self.create_posts()
+        self.client.get("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+
+        data = {
+            "title": "Updated Title for Post A",
+            "body": "Updated Body for Post A"
+        }
+        self.client.put("/api/posts/{}".format(post_a_id),
+            data=json.dumps(data),
+            content_type="application/json",
+            headers=[("Accept", "application/json")]
+        )
+
+        response = self.client.get("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+
+        self.assertEqual(response.status_code, 200)
+        post = json.loads(response.data.decode("ascii"))
+        self.assertEqual(post["title"], "Updated Title for Post A")
+        self.assertEqual(post["body"], "Updated Body for Post A")
+
+    def test_get_deleted_post(self):
+        """Deleting a post drops the cached copy"""
+        post_a_id, post_b_id, post_c_id = self.create_posts()
+        self.client.get("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+        self.client.delete("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+
+        response = self.client.get("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_post_racing_delete(self):
+        """A read which overlaps a delete doesn't cache the deleted post"""
+        post_a_id, post_b_id, post_c_id = self.create_posts()
+        get = session.get
+
+        def get_then_delete(*args, **kwargs):
+            post = get(*args, **kwargs)
+            # Another request deletes the post once this one has read it
+            self.client.delete("/api/posts/{}".format(post_a_id),
+                headers=[("Accept", "application/json")])
+            return post
+
+        with mock.patch.object(session, "get", side_effect=get_then_delete):
+            self.client.get("/api/posts/{}".format(post_a_id),
+                headers=[("Accept", "application/json")])
+
+        response = self.client.get("/api/posts/{}".format(post_a_id),
+            headers=[("Accept", "application/json")])
+
+        self.assertEqual(response.status_code, 404)
+
     def test_get_non_existent_post(self):
         """Getting a single post which doesn't exist"""
         response = self.client.get("/api/posts/1", 
@@ -111,6 +234,15 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(data["message"], 
                          "{} has been deleted successfully".format(post_b_id))
 
+    def test_delete_non_existent_post(self):
+        response = self.client.delete("/api/posts/1",
+            headers=[("Accept","application/json")])
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.mimetype, "application/json")
+        data = json.loads(response.data.decode("ascii"))
+        self.assertEqual(data["message"], "Could not find post with id 1")
+
     def test_get_post_with_titles(self):
         post_a_id, post_b_id, post_c_id = self.create_posts()
         response = self.client.get("/api/posts?title_like=whistles",
@@ -137,6 +269,18 @@ class TestAPI(unittest.TestCase):
         post = posts[0]
         self.assertEqual(post["body"], "Post with whiskers")
 
+    def test_get_post_with_partial_or_stop_words(self):
+        """Searches match whole words, and stop words match nothing"""
+        self.create_posts()
+
+        for query in ("title_like=whis", "title_like=the", "body_like=the"):
+            response = self.client.get("/api/posts?{}".format(query),
+                headers=[("Accept", "application/json")])
+
+            self.assertEqual(response.status_code, 200)
+            posts = json.loads(response.data.decode("ascii"))
+            self.assertEqual(posts, [], query)
+
     def test_get_post_with_body_and_title(self):
         post_a_id, post_b_id, post_c_id = self.create_posts()
         response = self.client.get("/api/posts?body_like=body&title_like=Post",
@@ -153,6 +297,40 @@ class TestAPI(unittest.TestCase):
         postB = posts[1]
         self.assertEqual(postB["title"], "Example Post B")
 
+    def test_upgrade_backfills_body_json(self):
+        """Upgrading a table from before body_json serializes its posts"""
+        with engine.begin() as connection:
+            connection.execute(text(
+                "ALTER TABLE posts DROP COLUMN body_json"))
+            connection.execute(text(
+                "INSERT INTO posts (title, body) "
+                "VALUES ('Old Post', 'Stored before body_json')"))
+
+        upgrade(engine)
+
+        columns = {column["name"]: column
+                   for column in inspect(engine).get_columns("posts")}
+        self.assertFalse(columns["body_json"]["nullable"])
+
+        response = self.client.get("/api/posts/1",
+            headers=[("Accept", "application/json")])
+        self.assertEqual(response.status_code, 200)
+        post = json.loads(response.data.decode("ascii"))
+        self.assertEqual(post, {"id": 1, "title": "Old Post",
+                                "body": "Stored before body_json"})
+
+    def test_upgrade_creates_search_indexes(self):
+        """Upgrading a table from before the search indexes adds them"""
+        with engine.begin() as connection:
+            connection.execute(text("DROP INDEX posts_title_fts"))
+            connection.execute(text("DROP INDEX posts_body_fts"))
+
+        upgrade(engine)
+
+        indexes = {index["name"] for index in inspect(engine).get_indexes("posts")}
+        self.assertIn("posts_title_fts", indexes)
+        self.assertIn("posts_body_fts", indexes)
+
     def test_post_request(self):
         data = {
             "title": "Example post",
@@ -180,6 +358,39 @@ class TestAPI(unittest.TestCase):
         post = posts[0]
         self.assertEqual(post.title, "Example post")
         self.assertEqual(post.body, "Testing the body of an example post")
+        self.assertEqual(post.body_json, response.data)
+
+    def test_post_parses_json_once(self):
+        data = {
+            "title": "Example post",
+            "body": "Testing the body of an example post"
+        }
+
+        with mock.patch.object(Request, "get_json", autospec=True,
+                               side_effect=Request.get_json) as get_json:
+            response = self.client.post("/api/posts",
+                data=json.dumps(data),
+                content_type="application/json",
+                headers=[("Accept", "application/json")])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_json.call_count, 1)
+
+    def test_put_parses_json_once(self):
+        data = {
+            "title": "New Title for Put",
+            "body": "Body for new post"
+        }
+
+        with mock.patch.object(Request, "get_json", autospec=True,
+                               side_effect=Request.get_json) as get_json:
+            response = self.client.put("/api/posts/1",
+                data=json.dumps(data),
+                content_type="application/json",
+                headers=[("Accept", "application/json")])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_json.call_count, 1)
 
     def test_unsupported_mimetype(self):
         data = "<xml></xml>"
@@ -211,7 +422,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 422)
 
         data = json.loads(response.data.decode("ascii"))
-        self.assertEqual(data["message"], "32 is not of type 'string'")
+        self.assertEqual(data["message"], "data.body must be string")
 
     def test_missing_data(self):
         data = {
@@ -227,7 +438,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 422)
 
         data = json.loads(response.data.decode("ascii"))
-        self.assertEqual(data["message"], "'body' is a required property")
+        self.assertEqual(data["message"], "data must contain ['body'] properties")
 
     def test_put_new_data(self):
         data = {
@@ -242,10 +453,14 @@ class TestAPI(unittest.TestCase):
         )
 
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(urlparse(response.headers.get("Location")).path,
+                         "/api/posts/1")
 
         data = json.loads(response.data.decode("ascii"))
-        self.assertEqual(data["message"], 
-            "New post has been added with Title: New Title for Put")
+        self.assertEqual(data["id"], 1)
+        self.assertEqual(data["title"], "New Title for Put")
+        self.assertEqual(data["body"], "Body for new post")
 
         posts = session.query(models.Post).all()
         self.assertEqual(len(posts),1)
@@ -277,7 +492,9 @@ class TestAPI(unittest.TestCase):
 
         self.assertEqual(response.status_code, 200)
         json_data = json.loads(response.data.decode("ascii"))
-        self.assertEqual(json_data["message"], "Post has been updated")
+        self.assertEqual(json_data["id"], 1)
+        self.assertEqual(json_data["title"], "Some New Title for Post A")
+        self.assertEqual(json_data["body"], "Some New Body for Post A's Body")
 
         posts = session.query(models.Post).order_by(models.Post.id).all()
         self.assertEqual(len(posts),3)